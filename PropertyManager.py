@@ -31,6 +31,10 @@ import tkinter.simpledialog
 import os.path #For filesystem functions
 import argparse #Process command line arguments
 import xml.etree.ElementTree as ET #Read/write XML
+import sqlite3 #On-disk parse cache
+import hashlib #Content hashes for the parse cache
+import json #Serialise cached data
+import time #Detect recently modified files
 
 
 class Globals:
@@ -44,37 +48,143 @@ class Globals:
 		"""Converts a filepath into the filename with no extension."""
 		return os.path.basename(path).rsplit('.', 1)[0]
 
+class ParseCache():
+	"""
+	Stores the data extracted from project files and property sheets in an sqlite
+	database so that files which have not changed since they were last seen do not
+	need to be parsed again. The database can be shared between runs and processes.
+	"""
+	filename = ".propcache"
+	schema_version = 1
+
+	def __init__(self, directory):
+		"""Open (or create) the cache stored in 'directory'. Falls back to an in-memory
+		   cache if 'directory' is not a directory or the cache there cannot be used."""
+		self.db = None
+		if os.path.isdir(directory):
+			try:
+				self.db = sqlite3.connect(os.path.join(directory, ParseCache.filename), timeout=5)
+				self.create_tables()
+			except sqlite3.Error:
+				if self.db != None:
+					self.db.close()
+				self.db = None
+		if self.db == None:
+			self.db = sqlite3.connect(":memory:")
+			self.create_tables()
+
+	def create_tables(self):
+		"""Creates the cache table, discarding any cache written by a different schema version."""
+		with self.db:
+			if self.db.execute("PRAGMA user_version").fetchone()[0] != ParseCache.schema_version:
+				self.db.execute("DROP TABLE IF EXISTS files")
+				self.db.execute("PRAGMA user_version = {}".format(ParseCache.schema_version))
+			self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT, kind TEXT, mtime INTEGER, "
+				"size INTEGER, hash TEXT, data TEXT, PRIMARY KEY (path, kind))")
+
+	def get(self, path, kind, extract):
+		"""Returns the data produced by calling 'extract' on the xml root of the file at 'path'. The
+		   file is only parsed if its mtime, size and content hash do not match the cached entry."""
+		path = os.path.realpath(path)
+		stat = os.stat(path)
+		try:
+			row = self.db.execute("SELECT mtime, size, hash, data FROM files WHERE path = ? AND kind = ?",
+				(path, kind)).fetchone()
+		except sqlite3.Error:
+			row = None #Cache is unavailable, e.g. locked by another process, so parse the file directly
+		if row != None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+			return json.loads(row[3])
+
+		#File looks different, check whether its content has actually changed
+		with open(path, "rb") as f:
+			content = f.read()
+		digest = hashlib.sha1(content).hexdigest()
+		if row != None and row[2] == digest:
+			data = row[3]
+		else:
+			data = json.dumps(extract(ET.fromstring(content)))
+
+		#A file modified within the last couple of seconds could change again without its mtime
+		#changing, so don't let the next lookup trust its stat
+		mtime = stat.st_mtime_ns if time.time_ns() - stat.st_mtime_ns > 2000000000 else -1
+		try:
+			with self.db:
+				self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+					(path, kind, mtime, stat.st_size, digest, data))
+		except sqlite3.Error:
+			pass #Cache is unavailable, e.g. locked by another process, so just use the parsed data
+		return json.loads(data)
+
+	def project(self, path):
+		"""Returns the configurations and imported property sheets of a project file."""
+		return self.get(path, "vcxproj", Project.extract)
+
+	def prop_sheet(self, path):
+		"""Returns the imported property sheets and the four field lists of a property sheet."""
+		return self.get(path, "props", PropSheet.extract)
+
+	def prune(self):
+		"""Removes entries for files which no longer exist."""
+		try:
+			paths = [row[0] for row in self.db.execute("SELECT DISTINCT path FROM files")]
+			with self.db:
+				self.db.executemany("DELETE FROM files WHERE path = ?",
+					[(path,) for path in paths if not os.path.isfile(path)])
+		except sqlite3.Error:
+			pass
+
 class Project():
 	"""
 	Stores the xml tree of a Visual Studio project file (.vcxproj) and provides
-	methods to get/set elements.
+	methods to get/set elements. Reads are served from a ParseCache, the xml tree
+	is only parsed when the project is modified.
 	"""
-	def __init__(self, filename):
-		"""Construct a Project object from the path to a Visual Studio project file."""
+	def __init__(self, filename, cache):
+		"""Construct a Project object from the path to a Visual Studio project file and a ParseCache."""
 		self.filename = filename
-		self.tree = ET.parse(filename)
+		self.cache = cache
+		self.tree = None
+		self.root = None
+
+	def extract(root):
+		"""Extracts the configurations and the property sheets imported under each configuration
+		   condition from the xml root of a project file."""
+		return {
+			"configs": [cc.get('Include')
+				for c in root.findall("{{{}}}ItemGroup".format(Globals.xmlns))
+				if c.get('Label') == "ProjectConfigurations"
+				for cc in c
+				if 'Include' in cc.attrib
+			],
+			"props": [[c.get('Condition', ""), [Globals.basename(cc.get('Project'))
+					for cc in c
+					if 'Condition' not in cc.attrib
+				]]
+				for c in root.findall("{{{}}}ImportGroup".format(Globals.xmlns))
+				if c.get('Label') == "PropertySheets"
+			]
+		}
+
+	def load_tree(self):
+		"""Parses the xml tree of the project file, ready for modification."""
+		self.tree = ET.parse(self.filename)
 		self.root = self.tree.getroot()
 
 	def get_configs(self):
 		"""Get the configurations associated with the project."""
-		return [cc.get('Include') 
-			for c in self.root.findall("{{{}}}ItemGroup".format(Globals.xmlns))
-			if c.get('Label') == "ProjectConfigurations"
-			for cc in c 
-			if 'Include' in cc.attrib
-		]
+		return self.cache.project(self.filename)["configs"]
 
 	def get_props(self, configuration):
 		"""Get the list of custom property sheets the project loads when 'configuration' is active."""
-		return [Globals.basename(cc.get('Project'))
-			for c in self.root.findall("{{{}}}ImportGroup".format(Globals.xmlns))
-			if c.get('Label') == "PropertySheets" and configuration in c.get('Condition')
-			for cc in c
-			if 'Condition' not in cc.attrib
+		return [prop
+			for condition, props in self.cache.project(self.filename)["props"]
+			if configuration in condition
+			for prop in props
 		]
 
 	def add_prop(self, configuration, prop_path):
 		"""Add a property sheet for a configuration in the project."""
+		self.load_tree()
 		for c in self.root.findall("{{{}}}ImportGroup".format(Globals.xmlns)):
 			if c.get('Label') == "PropertySheets" and configuration in c.get('Condition'):
 				new_prop = ET.Element("Import", {"Project": prop_path})
@@ -83,6 +193,7 @@ class Project():
 
 	def remove_prop(self, configuration, prop_name):
 		"""Remove a property sheet for a configuration in the project."""
+		self.load_tree()
 		for c in self.root.findall("{{{}}}ImportGroup".format(Globals.xmlns)):
 			if c.get('Label') == "PropertySheets" and configuration in c.get('Condition'):
 				for cc in c:
@@ -94,16 +205,17 @@ class Project():
 class PropSheet(tk.Toplevel):
 	"""
 	Stores the xml tree of a property sheet (.props) and creates a window to allow
-	modification of the property sheet fields.
+	modification of the property sheet fields. Fields are read from a ParseCache,
+	the xml tree is only parsed when the property sheet is modified.
 	"""
-	def __init__(self, master, filename):
-		"""Construct a PropSheet window from a root window and the path to a Property Sheet."""
+	def __init__(self, master, filename, cache):
+		"""Construct a PropSheet window from a root window, the path to a Property Sheet and a ParseCache."""
 		super().__init__(master)
-		#Create xml tree
 		self.filename = filename
-		self.tree = ET.parse(filename)
-		self.root = self.tree.getroot()
-		self.item_def_group = self.root.find("{{{}}}ItemDefinitionGroup".format(Globals.xmlns))
+		self.cache = cache
+		self.tree = None
+		self.root = None
+		self.item_def_group = None
 
 		#Populate the window with widgets
 		self.populate_widgets()
@@ -112,24 +224,55 @@ class PropSheet(tk.Toplevel):
 		#Load xml data into widgets
 		self.update_items()
 
+	def extract(root):
+		"""Extracts the imported property sheets and the include paths, library directories, library
+		   dependencies and preprocessor definitions from the xml root of a property sheet."""
+		def field(group, name):
+			node = root.find("{0}ItemDefinitionGroup/{0}{1}/{0}{2}".format("{{{}}}".format(Globals.xmlns), group, name))
+			if node == None or node.text == None or node.text.strip() == "":
+				return []
+			return [item.strip() for item in node.text.split(';')]
+
+		return {
+			"props": [Globals.basename(cc.get('Project'))
+				for c in root.findall("{{{}}}ImportGroup".format(Globals.xmlns))
+				if c.get('Label') == "PropertySheets"
+				for cc in c
+				if 'Condition' not in cc.attrib and 'Project' in cc.attrib
+			],
+			"includes": field("ClCompile", "AdditionalIncludeDirectories"),
+			"libdirs": field("Link", "AdditionalLibraryDirectories"),
+			"libdeps": field("Link", "AdditionalDependencies"),
+			"preprocs": field("ClCompile", "PreprocessorDefinitions")
+		}
+
+	def load_tree(self):
+		"""Parses the xml tree of the property sheet if it has not been parsed yet and returns
+		   the element containing the item definitions."""
+		if self.tree == None:
+			self.tree = ET.parse(self.filename)
+			self.root = self.tree.getroot()
+			self.item_def_group = self.root.find("{{{}}}ItemDefinitionGroup".format(Globals.xmlns))
+		return self.item_def_group
+
 	def include_node(self):
 		"""Returns the xml element containing include paths."""
-		return self.item_def_group.find("{{{}}}ClCompile".format(Globals.xmlns))\
+		return self.load_tree().find("{{{}}}ClCompile".format(Globals.xmlns))\
 			.find("{{{}}}AdditionalIncludeDirectories".format(Globals.xmlns))
 
 	def libdir_node(self):
 		"""Returns the xml element containing library directories."""
-		return self.item_def_group.find("{{{}}}Link".format(Globals.xmlns))\
+		return self.load_tree().find("{{{}}}Link".format(Globals.xmlns))\
 			.find("{{{}}}AdditionalLibraryDirectories".format(Globals.xmlns))
 
 	def libdep_node(self):
 		"""Returns the xml element containing library dependencies."""
-		return self.item_def_group.find("{{{}}}Link".format(Globals.xmlns))\
+		return self.load_tree().find("{{{}}}Link".format(Globals.xmlns))\
 			.find("{{{}}}AdditionalDependencies".format(Globals.xmlns))
 
 	def preproc_node(self):
 		"""Returns the xml element containing preprocessor definitions."""
-		return self.item_def_group.find("{{{}}}ClCompile".format(Globals.xmlns))\
+		return self.load_tree().find("{{{}}}ClCompile".format(Globals.xmlns))\
 			.find("{{{}}}PreprocessorDefinitions".format(Globals.xmlns))
 
 	def insert(self, element, text):
@@ -146,13 +289,6 @@ class PropSheet(tk.Toplevel):
 		else:
 			element.text = element.text.replace(text, '')
 
-	def parse_text(self, element):
-		"""Returns a list of strings from an element with semi-colon deliminated text."""
-		if element.text == None or element.text.strip() == "":
-			return []
-		return [item.strip() for item in element.text.split(';')]
-		
-
 	def add_inc(self):
 		"""Prompts for an include path and adds to the property sheet."""
 		inc_dir = tk.filedialog.askdirectory(title="Select include directory")
@@ -221,20 +357,22 @@ class PropSheet(tk.Toplevel):
 
 	def update_items(self):
 		"""Populates listbox widgets with contents of the property sheet."""
+		fields = self.cache.prop_sheet(self.filename)
+
 		self.w_include_list.delete(0, tk.END)
-		for item in self.parse_text(self.include_node()):
+		for item in fields["includes"]:
 			self.w_include_list.insert(tk.END, item)
 
 		self.w_libdir_list.delete(0, tk.END)
-		for item in self.parse_text(self.libdir_node()):
+		for item in fields["libdirs"]:
 			self.w_libdir_list.insert(tk.END, item)
 
 		self.w_libdep_list.delete(0, tk.END)
-		for item in self.parse_text(self.libdep_node()):
+		for item in fields["libdeps"]:
 			self.w_libdep_list.insert(tk.END, item)
 
 		self.w_preproc_list.delete(0, tk.END)
-		for item in self.parse_text(self.preproc_node()):
+		for item in fields["preprocs"]:
 			self.w_preproc_list.insert(tk.END, item)
 
 	def populate_widgets(self):
@@ -319,6 +457,8 @@ class PropertyManager(tk.Frame):
 		self.project = None #Project object containing the current project
 		self.prop_dir = tk.StringVar(self) #Directory of the property files
 		self.props = []
+		self.cache = None #ParseCache stored in the property file directory
+		self.cache_dir = None #Directory the current cache was opened in
 
 		#Set program variables
 		self.project_file.set(default_filepath)
@@ -461,6 +601,15 @@ class PropertyManager(tk.Frame):
 		self.status_bar.config(text=s)
 		self.status_bar.update_idletasks()
 
+	def get_cache(self):
+		"""Returns the ParseCache for the current property sheet directory, opening it if the
+		   directory has changed."""
+		if self.cache == None or self.cache_dir != self.prop_dir.get():
+			self.cache_dir = self.prop_dir.get()
+			self.cache = ParseCache(self.cache_dir)
+			self.cache.prune()
+		return self.cache
+
 	def select_project_file(self):
 		"""Displays a file browser to prompt for a project file then sets the project filepath to this."""
 		self.project_file.set(tk.filedialog.askopenfilename(
@@ -496,7 +645,7 @@ class PropertyManager(tk.Frame):
 		
 		#Load the project into memory
 		self.w_proj_label.config(fg="green")
-		self.project = Project(self.project_file.get())
+		self.project = Project(self.project_file.get(), self.get_cache())
 
 		#Update list of project configurations
 		self.w_config_select['menu'].delete(0, 'end')
@@ -527,6 +676,7 @@ class PropertyManager(tk.Frame):
 			return
 
 		#Sort and display property sheets as active or inactive
+		self.project.cache = self.get_cache()
 		cur_props = self.project.get_props(self.configuration.get())
 		for prop in self.props:
 			if prop in cur_props:
@@ -585,7 +735,7 @@ class PropertyManager(tk.Frame):
 			'</Link></ItemDefinitionGroup><ItemGroup /></Project>')
 
 		#Open the property sheet editor
-		PropSheet(self, new_name)
+		PropSheet(self, new_name, self.get_cache())
 		self.load_config_props()
 		return "break"
 
@@ -596,7 +746,7 @@ class PropertyManager(tk.Frame):
 			return "break"
 
 		#Open the property sheet editor
-		PropSheet(self, os.path.join(self.prop_dir.get(), self.selected_prop() + ".props"))
+		PropSheet(self, os.path.join(self.prop_dir.get(), self.selected_prop() + ".props"), self.get_cache())
 		return "break"
 
 	def copy_prop(self):